@@ -1,10 +1,25 @@
 import streamlit as st
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
+from google.api_core import retry as google_retry
+import pandas as pd
+import codecs
+import contextlib
 import json
+import orjson
+import hashlib
 import os
 import random
-import html
-from typing import Dict, List, Optional
+import time
+import re
+import secrets
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from pypdf import PdfReader
 
 # Page configuration
@@ -15,60 +30,260 @@ st.set_page_config(
 )
 
 # Custom CSS for serif font and styling
-st.markdown("""
-    <style>
-    .reading-area {
-        font-family: 'Georgia', 'Times New Roman', serif;
-        font-size: 18px;
-        line-height: 1.8;
-        padding: 20px;
-        text-align: justify;
-    }
-    .summary-box {
-        background-color: #f0f0f0;
-        padding: 15px;
-        border-radius: 5px;
-        margin-bottom: 20px;
-        font-family: 'Georgia', 'Times New Roman', serif;
-        font-style: italic;
-    }
-    .book-title {
-        font-family: 'Georgia', 'Times New Roman', serif;
-        font-size: 24px;
-        font-weight: bold;
-        margin-bottom: 10px;
-    }
-    </style>
-""", unsafe_allow_html=True)
+STYLESHEET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "style.css")
+
+@st.cache_resource
+def _load_style_html() -> str:
+    """Read the stylesheet once per server process and wrap it in a <style> tag."""
+    with open(STYLESHEET_FILE, 'r', encoding='utf-8') as f:
+        return f"<style>{f.read()}</style>"
+
+# Streamlit drops elements that a rerun does not emit, so the tag is still sent on
+# every run; only the file read and string building are done once.
+st.markdown(_load_style_html(), unsafe_allow_html=True)
 
 # Constants
 BOOKS_DATA_FILE = "books_data.json"
+SEGMENTS_DIR = "data"
+GEMINI_MODEL = "gemini-1.5-flash"
 SEGMENT_WORD_COUNT = 5000
+SEGMENT_WORD_SLACK = 500
+SUMMARY_PREFETCH_DEPTH = 2
+DECODE_WINDOW_BYTES = 1 << 20
+JOB_POLL_INTERVAL = 0.5
+SEGMENT_MEMO_ENTRIES = 8
+SEGMENT_MEMO_TTL = 3600
+SUMMARY_MEMO_ENTRIES = 128
+SUMMARY_FALLBACK = "Where we left off: Continuing from the previous segment..."
+
+# Sentence boundaries: terminal punctuation (plus closing quotes/brackets) followed by
+# whitespace, or a blank line between paragraphs. Trailing whitespace stays with the
+# sentence so the next one always starts on a non-space character.
+_SENTENCE_END_RE = re.compile(r'[.!?\u2026]+[\'"\u201d\u2019)\]]*\s+|\n[ \t]*\n\s*')
+_CHAPTER_RE = re.compile(r'^(chapter|part)\s+[ivxlcdm\d]+\b', re.I | re.M)
+_PARAGRAPH_BREAK_RE = re.compile(r'\n[ \t]*\n\s*')
+_WORD_RE = re.compile(r'\S+')
+# Decodes the first JSON value at an offset and reports where it ends, so prose or
+# code fences after an array in a model response are ignored
+_JSON_DECODER = json.JSONDecoder()
+
+# Retry transient Gemini failures with exponential backoff instead of failing the click
+_GEMINI_RETRY = google_retry.Retry(
+    predicate=google_retry.if_exception_type(
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.TooManyRequests,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded
+    ),
+    initial=0.3,
+    multiplier=2.0,
+    maximum=5.0,
+    timeout=30.0
+)
+
+# HTML escaping (same output as html.escape) plus line breaks, applied in a single pass
+_ESCAPE_TABLE = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    "'": '&#x27;',
+    '\n': '<br>'
+})
 
 # Initialize session state
-if 'books_data' not in st.session_state:
-    st.session_state.books_data = {}
 if 'api_key' not in st.session_state:
     st.session_state.api_key = None
+if 'summary_cache' not in st.session_state:
+    st.session_state.summary_cache = {}
+if 'processing_jobs' not in st.session_state:
+    st.session_state.processing_jobs = {}
+if 'summary_jobs' not in st.session_state:
+    st.session_state.summary_jobs = {}
+if 'summary_errors' not in st.session_state:
+    st.session_state.summary_errors = {}
+if 'processing_errors' not in st.session_state:
+    st.session_state.processing_errors = []
+
+@contextlib.contextmanager
+def _atomic_open(path: str) -> Iterator[BinaryIO]:
+    """
+    Open a temporary file next to path and rename it over path once the block
+    finishes, so readers never see a partial file. Each write gets its own
+    temporary file, since sessions are threads of one process and may write at once.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+def _atomic_write(path: str, payload: bytes) -> None:
+    """Write payload to path atomically, see _atomic_open."""
+    with _atomic_open(path) as f:
+        f.write(payload)
 
 def load_books_data() -> Dict:
     """Load books data from JSON file."""
     if os.path.exists(BOOKS_DATA_FILE):
         try:
-            with open(BOOKS_DATA_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(BOOKS_DATA_FILE, 'rb') as f:
+                payload = f.read()
+            st.session_state.books_data_saved_hash = hashlib.blake2b(payload).digest()
+            return orjson.loads(payload)
         except Exception as e:
             st.error(f"Error loading books data: {e}")
             return {}
     return {}
 
-def save_books_data(data: Dict) -> None:
-    """Save books data to JSON file."""
+def save_books_data(data: Dict) -> bool:
+    """
+    Save books data to JSON file, skipping the write if the content is unchanged.
+    Returns whether the file now holds data.
+    """
     try:
-        with open(BOOKS_DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        digest = hashlib.blake2b(payload).digest()
+        if digest == st.session_state.get('books_data_saved_hash'):
+            return True
+        
+        _atomic_write(BOOKS_DATA_FILE, payload)
+        st.session_state.books_data_saved_hash = digest
+        return True
     except Exception as e:
         st.error(f"Error saving books data: {e}")
+        return False
+
+def _segments_path(book_title: str) -> str:
+    """
+    New path for the JSONL sidecar file holding a book's segments. A random suffix
+    makes every upload distinct, so an entry loaded by another session before the
+    book was deleted and re-uploaded never points at the new files.
+    """
+    digest = hashlib.blake2b(book_title.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(SEGMENTS_DIR, f"{digest}-{secrets.token_hex(4)}.jsonl")
+
+def _offsets_path(segments_path: str) -> str:
+    """Path of the uint64 byte-offset index for a segments file."""
+    return os.path.splitext(segments_path)[0] + '.idx'
+
+def write_segments(book_title: str, segments: List[str]) -> str:
+    """
+    Write segments to a JSONL sidecar file, one segment per line, along with
+    an index of line byte offsets. Returns the sidecar path.
+    """
+    os.makedirs(SEGMENTS_DIR, exist_ok=True)
+    segments_path = _segments_path(book_title)
+    offsets = array('Q')
+    
+    with _atomic_open(segments_path) as f:
+        for segment in segments:
+            offsets.append(f.tell())
+            f.write(orjson.dumps(segment) + b'\n')
+    
+    _atomic_write(_offsets_path(segments_path), offsets.tobytes())
+    
+    return segments_path
+
+def read_segment(book_data: Dict, index: int) -> str:
+    """
+    Read a single segment by seeking to its offset instead of loading the whole book.
+    Raises OSError if the sidecar files are missing or don't match the entry.
+    """
+    segments_path = book_data['segments_path']
+    offset = array('Q')
+    
+    with open(_offsets_path(segments_path), 'rb') as f:
+        f.seek(index * offset.itemsize)
+        entry = f.read(offset.itemsize)
+    if index < 0 or len(entry) != offset.itemsize:
+        raise OSError(f"Segment {index} is missing from {segments_path}")
+    offset.frombytes(entry)
+    
+    with open(segments_path, 'rb') as f:
+        f.seek(offset[0])
+        try:
+            return orjson.loads(f.readline())
+        except orjson.JSONDecodeError as e:
+            raise OSError(f"Segment {index} of {segments_path} is corrupt: {e}") from e
+
+def delete_segments(book_data: Dict) -> None:
+    """Remove a book's sidecar files."""
+    segments_path = book_data['segments_path']
+    for path in (segments_path, _offsets_path(segments_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _migrate_inline_segments(books_data: Dict) -> List[str]:
+    """Move segments stored inline by older versions into sidecar files. Returns the migrated titles."""
+    migrated = []
+    for title, data in books_data.items():
+        if 'segments' in data:
+            data['segments_path'] = write_segments(title, data.pop('segments'))
+            migrated.append(title)
+    return migrated
+
+def _get_books_data() -> Dict:
+    """
+    Return the in-memory library, the source of truth for the session.
+    The JSON file is only read the first time it is needed.
+    """
+    if 'books_data' not in st.session_state:
+        st.session_state.books_data = load_books_data()
+        for title in _migrate_inline_segments(st.session_state.books_data):
+            _mark_books_data_dirty(title)
+    return st.session_state.books_data
+
+def _mark_books_data_dirty(book_title: str) -> None:
+    """
+    Record that a book was added, changed or removed, so the library is written
+    back to disk at the end of the rerun.
+    """
+    changes = st.session_state.setdefault('books_data_changes', {})
+    # The entry itself is kept, so later changes to it in the same rerun are included
+    changes[book_title] = _get_books_data().get(book_title)
+
+def _books_data_file_changed() -> bool:
+    """Whether the file on disk differs from what this session last loaded or saved."""
+    if not os.path.exists(BOOKS_DATA_FILE):
+        return False
+    with open(BOOKS_DATA_FILE, 'rb') as f:
+        digest = hashlib.blake2b(f.read()).digest()
+    return digest != st.session_state.get('books_data_saved_hash')
+
+@st.cache_resource
+def get_books_data_lock() -> threading.Lock:
+    """Process-wide lock serializing library flushes; sessions are threads of one process."""
+    return threading.Lock()
+
+def flush_books_data() -> None:
+    """
+    Save the library if it was mutated, coalescing all changes made in one rerun.
+    If another session saved the file in the meantime, the file is reloaded and only
+    this session's changes are applied on top, so the other session's edits survive.
+    Changes are kept for the next flush if the write fails.
+    """
+    changes = st.session_state.get('books_data_changes')
+    if not changes:
+        return
+    
+    with get_books_data_lock():
+        books_data = _get_books_data()
+        if _books_data_file_changed():
+            books_data = load_books_data()
+            for book_title, book_data in changes.items():
+                if book_data is None:
+                    books_data.pop(book_title, None)
+                else:
+                    books_data[book_title] = book_data
+            st.session_state.books_data = books_data
+        
+        if save_books_data(books_data):
+            st.session_state.books_data_changes = {}
 
 def extract_text_from_pdf(pdf_file) -> str:
     """Extract text content from a PDF file."""
@@ -91,25 +306,246 @@ def extract_text_from_pdf(pdf_file) -> str:
     except Exception as e:
         raise Exception(f"Error extracting text from PDF: {e}")
 
-def configure_gemini(api_key: str) -> bool:
-    """Configure Gemini API."""
+@st.cache_resource
+def get_model(api_key: str) -> genai.GenerativeModel:
+    """
+    Return a Gemini model instance for api_key, reused across calls and reruns.
+
+    genai.configure() sets a process-wide default client that the model would pick up
+    on its first request, whichever session configured it last. The model is bound to
+    a client built for its own key instead.
+    """
+    model = genai.GenerativeModel(GEMINI_MODEL)
+    model._client = glm.GenerativeServiceClient(client_options={'api_key': api_key})
+    return model
+
+def generate_content(model: genai.GenerativeModel, prompt: str):
+    """Call Gemini, retrying transient errors with backoff."""
+    return _GEMINI_RETRY(model.generate_content)(prompt)
+
+@st.cache_resource
+def get_gemini_memo(kind: str) -> Tuple[threading.Lock, OrderedDict]:
+    """
+    Process-wide memo of one kind of Gemini result, shared across sessions.
+
+    Gemini is called on worker threads, which have no ScriptRunContext and so can't use
+    st.cache_data; the memo is fetched on the script thread and passed to the worker.
+    """
+    return threading.Lock(), OrderedDict()
+
+def _memoized(memo: Tuple[threading.Lock, OrderedDict], key: Tuple, compute: Callable[[], Any],
+              max_entries: int, ttl: Optional[float] = None) -> Any:
+    """
+    Return the memoized result for key, computing it on a miss. The least recently used
+    entries are evicted past max_entries. Errors propagate and are not memoized.
+    """
+    lock, entries = memo
+    with lock:
+        if key in entries:
+            stored_at, value = entries[key]
+            if ttl is None or time.monotonic() - stored_at < ttl:
+                entries.move_to_end(key)
+                return value
+            del entries[key]
+    
+    # Computed outside the lock so other workers aren't blocked on a Gemini call
+    value = compute()
+    with lock:
+        entries[key] = (time.monotonic(), value)
+        entries.move_to_end(key)
+        while len(entries) > max_entries:
+            entries.popitem(last=False)
+    return value
+
+def _iter_text_windows(book_content: Union[str, memoryview]) -> Iterator[str]:
+    """
+    Yield the book text in windows. Uploaded bytes are decoded incrementally, so the
+    whole book is never materialized as a single Python string.
+    """
+    if isinstance(book_content, str):
+        yield book_content
+        return
+    
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for start in range(0, len(book_content), DECODE_WINDOW_BYTES):
+        yield decoder.decode(book_content[start:start + DECODE_WINDOW_BYTES])
+    yield decoder.decode(b'', final=True)
+
+def _iter_sentences(windows: Iterable[str]) -> Iterator[str]:
+    """Yield the sentences of a windowed text, each carrying its trailing whitespace."""
+    pending = ''
+    for window in windows:
+        pending += window
+        pos = 0
+        for match in _SENTENCE_END_RE.finditer(pending):
+            # A boundary touching the end of the window may continue in the next one
+            if match.end() == len(pending):
+                break
+            yield pending[pos:match.end()]
+            pos = match.end()
+        pending = pending[pos:]
+    if pending:
+        yield pending
+
+def _iter_word_chunks(text: str, n: int) -> Iterator[str]:
+    """Yield consecutive slices of text holding n words each, keeping the whitespace between them."""
+    start = 0
+    count = 0
+    for match in _WORD_RE.finditer(text):
+        if count == n:
+            yield text[start:match.start()]
+            start = match.start()
+            count = 0
+        count += 1
+    if start < len(text):
+        yield text[start:]
+
+def segment_book_local(book_content: Union[str, memoryview]) -> Optional[List[str]]:
+    """
+    Split a book into segments of approximately SEGMENT_WORD_COUNT words locally.
+    Accepts either text or the raw UTF-8 bytes of an uploaded file.
+
+    Segments close at a chapter heading found within SEGMENT_WORD_SLACK words of the
+    target, otherwise at the first sentence boundary past the target. Sentences too long
+    to fit in a segment (a long poem, a table of contents) are cut at word boundaries.
+    Returns an empty list for empty text, and None only when the whole text is a single
+    run-on sentence, so the caller can fall back to Gemini.
+    """
+    segments = []
+    sentences: List[str] = []
+    word_counts: List[int] = []
+    word_count = 0
+    sentence_count = 0
+    has_run_on = False
+
+    for sentence in _iter_sentences(_iter_text_windows(book_content)):
+        sentence_count += 1
+        words = len(sentence.split())
+        if words > SEGMENT_WORD_COUNT + SEGMENT_WORD_SLACK:
+            has_run_on = True
+            pieces = [(piece, len(piece.split())) for piece in _iter_word_chunks(sentence, SEGMENT_WORD_SLACK)]
+        else:
+            pieces = [(sentence, words)]
+
+        for piece, words in pieces:
+            # Prefer a chapter break once we are close enough to the target size
+            if (sentences and word_count >= SEGMENT_WORD_COUNT - SEGMENT_WORD_SLACK
+                    and _CHAPTER_RE.match(piece)):
+                segments.append(''.join(sentences).strip())
+                sentences, word_counts, word_count = [], [], 0
+
+            sentences.append(piece)
+            word_counts.append(words)
+            word_count += words
+
+            # No chapter break within the slack: cut at the sentence that crossed the target
+            while word_count >= SEGMENT_WORD_COUNT + SEGMENT_WORD_SLACK:
+                cut, running = 0, 0
+                while running < SEGMENT_WORD_COUNT:
+                    running += word_counts[cut]
+                    cut += 1
+                segments.append(''.join(sentences[:cut]).strip())
+                sentences, word_counts = sentences[cut:], word_counts[cut:]
+                word_count -= running
+
+    # No sentence boundary anywhere: leave the segmentation to Gemini
+    if sentence_count == 1 and has_run_on:
+        return None
+
+    # Add remaining sentences as last segment
+    if word_count:
+        segments.append(''.join(sentences).strip())
+
+    return segments
+
+def hash_text(text: Union[str, memoryview]) -> str:
+    """Return a stable content digest used as a cache key. Buffers are hashed without copying."""
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    return hashlib.blake2b(text).hexdigest()
+
+def _parse_json_array(response_text: str) -> List:
+    """
+    Parse the first JSON array out of a Gemini response, tolerating code fences and
+    surrounding prose, including brackets in the prose itself.
+    """
+    start = response_text.find('[')
+    while start != -1:
+        try:
+            value, _ = _JSON_DECODER.raw_decode(response_text, start)
+        except ValueError:
+            value = None
+        if isinstance(value, list):
+            return value
+        start = response_text.find('[', start + 1)
+    
+    raise ValueError("Invalid response format from Gemini")
+
+def segment_book_with_gemini(book_title: str, book_content: Union[str, memoryview],
+                             model: genai.GenerativeModel,
+                             memo: Tuple[threading.Lock, OrderedDict]) -> Tuple[List[str], Optional[str]]:
+    """
+    Split book into logical segments of approximately 5000 words each.
+
+    Segmentation runs locally on sentence and chapter boundaries; Gemini is only asked
+    when the text has no sentence structure to cut on, and only those results are
+    memoized by content hash. Returns the segments and, if Gemini failed and the
+    word-count fallback was used, the error message. Runs on a worker thread, so the
+    caller reports the error.
+    """
+    segments = segment_book_local(book_content)
+    if segments is not None:
+        return segments, None
+    
+    # Gemini needs the full text; only this rare path decodes the whole book at once
+    book_content = _decode_book(book_content)
     try:
-        genai.configure(api_key=api_key)
-        return True
+        # Each entry holds a whole book, hence the small bound and the expiry
+        return _memoized(
+            memo,
+            (hash_text(book_content), book_title),
+            lambda: _segment_with_gemini(book_title, book_content, model),
+            SEGMENT_MEMO_ENTRIES,
+            SEGMENT_MEMO_TTL
+        ), None
     except Exception as e:
-        st.error(f"Error configuring Gemini: {e}")
-        return False
+        # Kept out of the memo so a transient Gemini failure is retried next time
+        return _segment_by_word_count(book_content), str(e)
 
-def segment_book_with_gemini(book_title: str, book_content: str, api_key: str) -> List[str]:
+def _decode_book(book_content: Union[str, memoryview]) -> str:
+    """Return the book as a single string, decoding uploaded bytes if needed."""
+    if isinstance(book_content, str):
+        return book_content
+    return str(book_content, 'utf-8', errors='replace')
+
+def _segment_by_word_count(book_content: str) -> List[str]:
     """
-    Use Gemini to split book into logical segments of approximately 5000 words each.
+    Fallback segmentation by word count, slicing the original text at word offsets
+    instead of building a word list and re-joining it.
     """
-    configure_gemini(api_key)
+    segments = []
+    start = None
+    current_word_count = 0
     
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
+    for match in _WORD_RE.finditer(book_content):
+        if start is None:
+            start = match.start()
+        current_word_count += 1
         
-        prompt = f"""You are given a book titled "{book_title}". Please analyze the content and divide it into logical segments where each segment contains approximately {SEGMENT_WORD_COUNT} words.
+        if current_word_count >= SEGMENT_WORD_COUNT:
+            segments.append(book_content[start:match.end()])
+            start = None
+            current_word_count = 0
+    
+    # Add remaining words as last segment
+    if start is not None:
+        segments.append(book_content[start:].rstrip())
+    
+    return segments
+
+def _segment_with_gemini(book_title: str, book_content: str, model: genai.GenerativeModel) -> List[str]:
+    """Gemini segmentation behind segment_book_with_gemini; errors propagate to the caller."""
+    prompt = f"""You are given a book titled "{book_title}". Please analyze the content and divide it into logical segments where each segment contains approximately {SEGMENT_WORD_COUNT} words.
 
 Each segment should:
 - End at a natural break point (chapter end, scene break, or paragraph boundary)
@@ -123,68 +559,61 @@ Book content:
 
 Return format: ["segment1 text...", "segment2 text...", "segment3 text..."]
 """
-        
-        response = model.generate_content(prompt)
-        
-        # Parse the JSON response
-        response_text = response.text.strip()
-        # Remove markdown code blocks if present
-        if response_text.startswith('```json'):
-            response_text = response_text[7:]
-        if response_text.startswith('```'):
-            response_text = response_text[3:]
-        if response_text.endswith('```'):
-            response_text = response_text[:-3]
-        response_text = response_text.strip()
-        
-        segments = json.loads(response_text)
-        
-        if not isinstance(segments, list) or len(segments) == 0:
-            raise ValueError("Invalid response format from Gemini")
-        
-        return segments
     
-    except Exception as e:
-        st.error(f"Error segmenting book with Gemini: {e}")
-        # Fallback: simple word-count based segmentation
-        words = book_content.split()
-        segments = []
-        current_segment = []
-        current_word_count = 0
-        
-        for word in words:
-            current_segment.append(word)
-            current_word_count += 1
-            
-            if current_word_count >= SEGMENT_WORD_COUNT:
-                segments.append(' '.join(current_segment))
-                current_segment = []
-                current_word_count = 0
-        
-        # Add remaining words as last segment
-        if current_segment:
-            segments.append(' '.join(current_segment))
-        
-        return segments
+    response = generate_content(model, prompt)
+    
+    segments = _parse_json_array(response.text)
+    
+    if len(segments) == 0:
+        raise ValueError("Invalid response format from Gemini")
+    
+    return segments
 
-def generate_summary_with_gemini(book_title: str, previous_segment: str, current_segment: str, api_key: str) -> str:
+def tail_words(text: str, n: int) -> str:
+    """Return the last n space-separated words of text without splitting the whole string."""
+    text = text.rstrip()
+    cut = len(text)
+    for _ in range(n):
+        cut = text.rfind(' ', 0, cut)
+        if cut == -1:
+            return text
+    return text[cut + 1:]
+
+def head_words(text: str, n: int) -> str:
+    """Return the first n space-separated words of text without splitting the whole string."""
+    text = text.lstrip()
+    cut = -1
+    for _ in range(n):
+        cut = text.find(' ', cut + 1)
+        if cut == -1:
+            return text
+    return text[:cut]
+
+def _summary_contexts(previous_segment: str, current_segment: str) -> Tuple[str, str]:
+    """Return the last 1000 words of the previous segment and the first 500 of the current one."""
+    return tail_words(previous_segment, 1000), head_words(current_segment, 500)
+
+def generate_summary_with_gemini(book_title: str, previous_segment: str, current_segment: str,
+                                 model: genai.GenerativeModel,
+                                 memo: Tuple[threading.Lock, OrderedDict]) -> str:
     """
-    Use Gemini to generate a 2-line "Where we left off" summary.
+    Use Gemini to generate a 2-line "Where we left off" summary, memoized on the book
+    title and the context hashes.
+    Runs on a worker thread; errors propagate to the caller collecting the result.
     """
-    configure_gemini(api_key)
+    prev_context, curr_context = _summary_contexts(previous_segment, current_segment)
     
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Take last 1000 words of previous segment for context
-        prev_words = previous_segment.split()[-1000:]
-        prev_context = ' '.join(prev_words)
-        
-        # Take first 500 words of current segment
-        curr_words = current_segment.split()[:500]
-        curr_context = ' '.join(curr_words)
-        
-        prompt = f"""You are reading a book titled "{book_title}". 
+    return _memoized(
+        memo,
+        (book_title, hash_text(prev_context), hash_text(curr_context)),
+        lambda: _summarize_with_gemini(book_title, prev_context, curr_context, model),
+        SUMMARY_MEMO_ENTRIES
+    )
+
+def _summarize_with_gemini(book_title: str, prev_context: str, curr_context: str,
+                           model: genai.GenerativeModel) -> str:
+    """Gemini call behind generate_summary_with_gemini; errors propagate to the caller."""
+    prompt = f"""You are reading a book titled "{book_title}". 
 
 Based on where we left off and what comes next, write a 2-line summary (maximum 2 sentences) that reminds the reader what was happening.
 
@@ -196,64 +625,238 @@ Current section begins with:
 
 Write a concise 2-line summary starting with "Where we left off:" that bridges these sections.
 """
-        
-        response = model.generate_content(prompt)
-        summary = response.text.strip()
-        
-        return summary
     
-    except Exception as e:
-        st.error(f"Error generating summary: {e}")
-        return "Where we left off: Continuing from the previous segment..."
+    response = generate_content(model, prompt)
+    return response.text.strip()
 
-def process_uploaded_book(book_title: str, book_content: str, api_key: str) -> None:
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    """Worker pool shared across sessions for Gemini calls that should not block a rerun."""
+    return ThreadPoolExecutor(max_workers=4)
+
+def _generate_summaries_batch(model, transitions: List[Dict]) -> List[str]:
     """
-    Process an uploaded book: segment it and save to books_data.
+    Generate several "Where we left off" summaries with a single Gemini request.
+    Runs on a worker thread, so it must not touch Streamlit APIs.
     """
-    with st.spinner(f"Processing '{book_title}'... This may take a moment."):
-        segments = segment_book_with_gemini(book_title, book_content, api_key)
+    prompt = f"""You are helping a reader who switches between several books.
+
+Below is a JSON array of transitions. Each item has the book title ("book"), the text the previous section ended with ("prev_ctx") and the text the current section begins with ("curr_ctx").
+
+For each item, write a concise 2-line summary (maximum 2 sentences) starting with "Where we left off:" that reminds the reader what was happening and bridges the two sections.
+
+Return ONLY a JSON array of strings with exactly {len(transitions)} summaries, in the same order as the input. Do not include any other text or explanation.
+
+Transitions:
+{json.dumps(transitions, ensure_ascii=False)}
+"""
+    
+    response = generate_content(model, prompt)
+    summaries = _parse_json_array(response.text)
+    
+    if len(summaries) != len(transitions):
+        raise ValueError("Gemini returned the wrong number of summaries")
+    
+    return [str(summary).strip() for summary in summaries]
+
+def _collect_prefetched_summaries() -> None:
+    """Move the results of a finished prefetch into the summary cache."""
+    pending = st.session_state.get('summary_prefetch')
+    if pending is None or not pending[1].done():
+        return
+    
+    keys, future = pending
+    st.session_state.summary_prefetch = None
+    # A failed batch is dropped; those summaries are generated on demand instead
+    if future.exception() is None:
+        books_data = _get_books_data()
+        st.session_state.summary_cache.update(
+            (key, summary) for key, summary in zip(keys, future.result()) if key[0] in books_data
+        )
+
+def collect_summary_jobs() -> None:
+    """
+    Move finished on-demand summaries into the summary cache, whether or not their
+    segment is still displayed. Errors are kept for get_summary to report.
+    """
+    summary_jobs = st.session_state.summary_jobs
+    for key, future in list(summary_jobs.items()):
+        if not future.done():
+            continue
+        del summary_jobs[key]
+        if future.exception() is None:
+            st.session_state.summary_cache[key] = future.result()
+        else:
+            st.session_state.summary_errors[key] = future.exception()
+
+def prefetch_summaries(books_data: Dict, api_key: str) -> None:
+    """
+    Pre-generate summaries for the next SUMMARY_PREFETCH_DEPTH transitions of every
+    book in one batched Gemini request, fired on a worker thread.
+    """
+    _collect_prefetched_summaries()
+    if st.session_state.get('summary_prefetch') is not None:
+        return
+    
+    summary_cache = st.session_state.summary_cache
+    keys = []
+    transitions = []
+    
+    for title, data in books_data.items():
+        start = max(data['current_index'], 1)
+        stop = min(data['current_index'] + SUMMARY_PREFETCH_DEPTH, data['total_segments'])
+        for index in range(start, stop):
+            if (title, index) in summary_cache:
+                continue
+            try:
+                prev_context, curr_context = _summary_contexts(
+                    read_segment(data, index - 1),
+                    read_segment(data, index)
+                )
+            except OSError:
+                # Sidecar removed by another session; the read path drops the book
+                continue
+            keys.append((title, index))
+            transitions.append({'book': title, 'prev_ctx': prev_context, 'curr_ctx': curr_context})
+    
+    if not transitions:
+        return
+    
+    future = get_executor().submit(_generate_summaries_batch, get_model(api_key), transitions)
+    st.session_state.summary_prefetch = (keys, future)
+
+def get_summary(book_title: str, segment_index: int, previous_segment: str, current_segment: str, api_key: str) -> Optional[str]:
+    """
+    Return the "Where we left off" summary for a segment, served from the prefetch
+    cache when possible. On a miss the summary is generated on a worker thread and
+    None is returned until it is ready. A failure is reported on every rerun until
+    another segment is displayed, which clears summary_errors and allows a retry.
+    """
+    key = (book_title, segment_index)
+    _collect_prefetched_summaries()
+    collect_summary_jobs()
+    
+    summary_cache = st.session_state.summary_cache
+    if key in summary_cache:
+        return summary_cache[key]
+    
+    error = st.session_state.summary_errors.get(key)
+    if error is not None:
+        st.error(f"Error generating summary: {error}")
+        return SUMMARY_FALLBACK
+    
+    # The summary is already being generated by a prefetch batch; don't request it twice
+    pending = st.session_state.get('summary_prefetch')
+    if pending is not None and key in pending[0]:
+        return None
+    
+    summary_jobs = st.session_state.summary_jobs
+    if key not in summary_jobs:
+        summary_jobs[key] = get_executor().submit(
+            generate_summary_with_gemini, book_title, previous_segment, current_segment,
+            get_model(api_key), get_gemini_memo('summaries')
+        )
+    return None
+
+def _read_and_segment_book(book_title: str, uploaded_file, file_extension: str,
+                           model: genai.GenerativeModel,
+                           memo: Tuple[threading.Lock, OrderedDict]) -> Tuple[List[str], Optional[str]]:
+    """Read an uploaded file and segment it, see segment_book_with_gemini. Runs on a worker thread."""
+    # Reset file pointer to beginning before reading
+    uploaded_file.seek(0)
+    
+    if file_extension == 'pdf':
+        # Extract text from PDF
+        book_content = extract_text_from_pdf(uploaded_file)
+    else:
+        # Use the uploaded bytes in place; they are decoded while segmenting
+        book_content = uploaded_file.getbuffer()
+    
+    return segment_book_with_gemini(book_title, book_content, model, memo)
+
+def process_uploaded_book(book_title: str, uploaded_file, file_extension: str, api_key: str) -> None:
+    """
+    Process an uploaded book: start segmenting it on a worker thread.
+    finish_processing_jobs() saves the result to books_data once it is ready.
+    """
+    st.session_state.processing_jobs[book_title] = get_executor().submit(
+        _read_and_segment_book, book_title, uploaded_file, file_extension,
+        get_model(api_key), get_gemini_memo('segments')
+    )
+
+def finish_processing_jobs(api_key: str) -> None:
+    """Save the segments of books whose background processing has finished."""
+    processing_jobs = st.session_state.processing_jobs
+    
+    for book_title, future in list(processing_jobs.items()):
+        if not future.done():
+            continue
+        del processing_jobs[book_title]
+        
+        # Kept until dismissed, since polling reruns would otherwise clear them
+        processing_errors = st.session_state.processing_errors
+        try:
+            segments, gemini_error = future.result()
+        except Exception as e:
+            processing_errors.append(f"Error reading {book_title}: {e}")
+            continue
+        
+        if gemini_error:
+            processing_errors.append(f"Error segmenting book with Gemini: {gemini_error}. "
+                                     f"'{book_title}' was split by word count instead.")
+        
+        if not segments:
+            processing_errors.append(f"Error reading {book_title}: the file contains no text.")
+            continue
         
-        books_data = load_books_data()
+        books_data = _get_books_data()
         books_data[book_title] = {
-            'segments': segments,
             'current_index': 0,
-            'total_segments': len(segments)
+            'total_segments': len(segments),
+            'segments_path': write_segments(book_title, segments)
         }
-        save_books_data(books_data)
-        st.session_state.books_data = books_data
+        _mark_books_data_dirty(book_title)
         
-        st.success(f"✅ '{book_title}' processed! Created {len(segments)} segments.")
+        st.toast(f"✅ '{book_title}' processed! Created {len(segments)} segments.")
+        prefetch_summaries(books_data, api_key)
 
 def get_random_unread_segment() -> Optional[tuple]:
     """
     Get a random book and its next unread segment.
     Returns: (book_title, segment_text, segment_index, is_first_segment, previous_segment)
     """
-    books_data = load_books_data()
+    books_data = _get_books_data()
     
     if not books_data:
         return None
     
-    # Filter books that have unread segments
-    available_books = [
-        (title, data) for title, data in books_data.items()
-        if data['current_index'] < data['total_segments']
-    ]
+    # Pick a random book with unread segments in a single pass (reservoir sampling, k=1)
+    chosen = None
+    count = 0
+    for title, data in books_data.items():
+        if data['current_index'] < data['total_segments']:
+            count += 1
+            if random.random() < 1 / count:
+                chosen = (title, data)
     
-    if not available_books:
+    if chosen is None:
         return None
     
-    # Pick a random book
-    book_title, book_data = random.choice(available_books)
+    book_title, book_data = chosen
     current_index = book_data['current_index']
-    segment_text = book_data['segments'][current_index]
+    try:
+        segment_text = read_segment(book_data, current_index)
+        previous_segment = read_segment(book_data, current_index - 1) if current_index > 0 else None
+    except OSError:
+        # The book's segment files are gone (e.g. deleted from another session)
+        delete_book(book_title)
+        st.toast(f"⚠️ '{book_title}' is no longer available and was removed from the library.")
+        return get_random_unread_segment()
     is_first_segment = (current_index == 0)
-    previous_segment = book_data['segments'][current_index - 1] if current_index > 0 else None
     
     # Update current_index for next time
     books_data[book_title]['current_index'] = current_index + 1
-    save_books_data(books_data)
-    st.session_state.books_data = books_data
+    _mark_books_data_dirty(book_title)
     
     return (book_title, segment_text, current_index, is_first_segment, previous_segment)
 
@@ -265,19 +868,28 @@ def calculate_progress(book_data: Dict) -> float:
 
 def reset_book_progress(book_title: str) -> None:
     """Reset reading progress for a specific book."""
-    books_data = load_books_data()
+    books_data = _get_books_data()
     if book_title in books_data:
         books_data[book_title]['current_index'] = 0
-        save_books_data(books_data)
-        st.session_state.books_data = books_data
+        _mark_books_data_dirty(book_title)
 
 def delete_book(book_title: str) -> None:
     """Delete a book from the library."""
-    books_data = load_books_data()
+    books_data = _get_books_data()
     if book_title in books_data:
-        del books_data[book_title]
-        save_books_data(books_data)
-        st.session_state.books_data = books_data
+        delete_segments(books_data.pop(book_title))
+        _mark_books_data_dirty(book_title)
+        # Forget summaries of the deleted book, including ones still being generated
+        for summaries in (st.session_state.summary_cache, st.session_state.summary_errors):
+            for key in [key for key in summaries if key[0] == book_title]:
+                del summaries[key]
+        summary_jobs = st.session_state.summary_jobs
+        for key in [key for key in summary_jobs if key[0] == book_title]:
+            summary_jobs.pop(key).cancel()
+        # Stop displaying a segment of the deleted book
+        current_display = st.session_state.get('current_display')
+        if current_display and current_display['book_title'] == book_title:
+            del st.session_state.current_display
 
 # Main App
 def main():
@@ -298,6 +910,15 @@ def main():
         if api_key:
             st.session_state.api_key = api_key
         
+        finish_processing_jobs(api_key)
+        collect_summary_jobs()
+        
+        for message in st.session_state.processing_errors:
+            st.error(message)
+        if st.session_state.processing_errors and st.button("Dismiss errors", key="dismiss_processing_errors"):
+            st.session_state.processing_errors = []
+            st.rerun()
+        
         st.divider()
         
         st.header("📤 Upload Books")
@@ -311,62 +932,74 @@ def main():
         )
         
         if uploaded_files and api_key:
+            # Titles already in the library, plus titles seen earlier in this loop so that
+            # e.g. book.txt and book.pdf don't produce two buttons with the same key
+            seen_titles = set(_get_books_data()) | set(st.session_state.processing_jobs)
+            
             for uploaded_file in uploaded_files:
                 # Extract book title and determine file type
                 file_extension = uploaded_file.name.split('.')[-1].lower()
+                if file_extension not in ('txt', 'pdf'):
+                    continue
                 book_title = uploaded_file.name.rsplit('.', 1)[0]
                 
                 # Check if book already exists
-                books_data = load_books_data()
-                if book_title not in books_data:
-                    if st.button(f"Process {book_title}", key=f"process_{book_title}"):
-                        try:
-                            # Reset file pointer to beginning before reading
-                            uploaded_file.seek(0)
-                            
-                            if file_extension == 'pdf':
-                                # Extract text from PDF
-                                book_content = extract_text_from_pdf(uploaded_file)
-                            else:
-                                # Read as text file
-                                book_content = uploaded_file.read().decode('utf-8', errors='replace')
-                            
-                            process_uploaded_book(book_title, book_content, api_key)
-                        except Exception as e:
-                            st.error(f"Error reading {book_title}: {e}")
+                if book_title in seen_titles:
+                    continue
+                seen_titles.add(book_title)
+                
+                if st.button(f"Process {book_title}", key=f"process_{book_title}"):
+                    process_uploaded_book(book_title, uploaded_file, file_extension, api_key)
+                    st.rerun()
         
         elif uploaded_files and not api_key:
             st.warning("⚠️ Please enter your Gemini API key first!")
         
+        for book_title in st.session_state.processing_jobs:
+            st.info(f"⏳ Processing '{book_title}'... This may take a moment.")
+        
         st.divider()
         
         # Progress indicators
         st.header("📊 Reading Progress")
-        books_data = load_books_data()
+        books_data = _get_books_data()
         
         if books_data:
-            for title, data in books_data.items():
-                progress = calculate_progress(data)
-                st.write(f"**{title}**")
-                st.progress(progress / 100)
-                st.write(f"{progress:.0f}% complete ({data['current_index']}/{data['total_segments']} segments)")
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button("🔄", key=f"reset_{title}", help="Reset progress"):
-                        reset_book_progress(title)
-                        st.rerun()
-                with col2:
-                    if st.button("🗑️", key=f"delete_{title}", help="Delete book"):
-                        delete_book(title)
-                        st.rerun()
-                
-                st.divider()
+            # One table for all books instead of a block of widgets per book
+            progress_df = pd.DataFrame([
+                {
+                    'Book': title,
+                    'Progress': calculate_progress(data),
+                    'Read': data['current_index'],
+                    'Total': data['total_segments']
+                }
+                for title, data in books_data.items()
+            ])
+            st.dataframe(
+                progress_df,
+                column_config={
+                    'Progress': st.column_config.ProgressColumn(format="%.0f%%", min_value=0, max_value=100)
+                },
+                hide_index=True,
+                use_container_width=True
+            )
+            
+            managed_title = st.selectbox("Manage book", list(books_data.keys()))
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("🔄 Reset", help="Reset progress", use_container_width=True):
+                    reset_book_progress(managed_title)
+                    st.rerun()
+            with col2:
+                if st.button("🗑️ Delete", help="Delete book", use_container_width=True):
+                    delete_book(managed_title)
+                    st.rerun()
         else:
             st.info("No books uploaded yet.")
     
     # Main content area
-    books_data = load_books_data()
+    books_data = _get_books_data()
+    awaiting_summary = False
     
     if not books_data:
         st.info("👈 Upload some books to get started!")
@@ -374,12 +1007,11 @@ def main():
         st.warning("⚠️ Please enter your Gemini API key in the sidebar!")
     else:
         # Check if there are any unread segments
-        available_books = [
-            (title, data) for title, data in books_data.items()
-            if data['current_index'] < data['total_segments']
-        ]
+        has_unread_segments = any(
+            data['current_index'] < data['total_segments'] for data in books_data.values()
+        )
         
-        if not available_books:
+        if not has_unread_segments:
             st.success("🎉 You've finished reading all your books!")
             st.balloons()
             if st.button("Reset All Progress"):
@@ -394,7 +1026,8 @@ def main():
                 if result:
                     book_title, segment_text, segment_index, is_first_segment, previous_segment = result
                     
-                    # Store in session state for display
+                    # Store in session state for display; a summary that failed before is retried
+                    st.session_state.summary_errors = {}
                     st.session_state.current_display = {
                         'book_title': book_title,
                         'segment_text': segment_text,
@@ -402,38 +1035,62 @@ def main():
                         'is_first_segment': is_first_segment,
                         'previous_segment': previous_segment
                     }
+                    prefetch_summaries(books_data, api_key)
                     st.rerun()
             
+            # Drop the displayed segment if its book was deleted, possibly from another session
+            current_display = st.session_state.get('current_display')
+            if current_display and current_display['book_title'] not in books_data:
+                del st.session_state.current_display
+            
             # Display the current segment if available
             if 'current_display' in st.session_state:
                 display_data = st.session_state.current_display
                 
                 # Escape HTML to prevent XSS
-                safe_book_title = html.escape(display_data['book_title'])
+                safe_book_title = display_data['book_title'].translate(_ESCAPE_TABLE)
                 st.markdown(f"<div class='book-title'>📖 {safe_book_title}</div>", unsafe_allow_html=True)
                 st.write(f"*Segment {display_data['segment_index'] + 1} of {books_data[display_data['book_title']]['total_segments']}*")
                 
                 # Generate and display summary if not first segment
                 if not display_data['is_first_segment'] and display_data['previous_segment']:
-                    with st.spinner("Generating summary..."):
-                        summary = generate_summary_with_gemini(
-                            display_data['book_title'],
-                            display_data['previous_segment'],
-                            display_data['segment_text'],
-                            api_key
-                        )
+                    summary = get_summary(
+                        display_data['book_title'],
+                        display_data['segment_index'],
+                        display_data['previous_segment'],
+                        display_data['segment_text'],
+                        api_key
+                    )
+                    if summary is None:
+                        awaiting_summary = True
+                        st.caption("⏳ Generating summary...")
+                    else:
                         # Escape HTML and preserve line breaks
-                        safe_summary = html.escape(summary).replace('\n', '<br>')
+                        safe_summary = summary.translate(_ESCAPE_TABLE)
                         st.markdown(f"<div class='summary-box'>{safe_summary}</div>", unsafe_allow_html=True)
                 
-                # Display the segment text with HTML escaping to prevent XSS, preserving formatting
-                safe_segment_text = html.escape(display_data['segment_text']).replace('\n', '<br>')
-                st.markdown(f"<div class='reading-area'>{safe_segment_text}</div>", unsafe_allow_html=True)
+                # Display the segment paragraph by paragraph so the browser can paint the first
+                # ones early, with HTML escaping to prevent XSS, preserving formatting
+                reading_area = st.container()
+                for paragraph in _PARAGRAPH_BREAK_RE.split(display_data['segment_text']):
+                    if paragraph:
+                        safe_paragraph = paragraph.translate(_ESCAPE_TABLE)
+                        reading_area.markdown(f"<p class='reading-area'>{safe_paragraph}</p>", unsafe_allow_html=True)
                 
                 # Show progress
                 current_progress = calculate_progress(books_data[display_data['book_title']])
                 st.progress(current_progress / 100)
                 st.write(f"Progress: {current_progress:.0f}%")
+    
+    # Gemini work runs on worker threads; poll with short pauses until results are
+    # ready to be shown. The page stays interactive in the meantime.
+    if st.session_state.processing_jobs or awaiting_summary:
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Runs on st.rerun() too, so mutations from button handlers are persisted once
+        flush_books_data()